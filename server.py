@@ -3,43 +3,205 @@ MT4 Multi-Account Monitor - Central Server v2.3
 - Cent account support (USC/USc → divide by 100)
 - Telegram alerts for dangerous margin levels
 - Auto-cleanup: removes accounts with balance < MIN_BALANCE (default $5)
+  and hides accounts that stop reporting for STALE_AFTER seconds (default 300;
+  their profit history is kept and resumes on the next report, and is pruned
+  after PROFIT_RETENTION_DAYS without a report, default 30)
 - Daily & cumulative profit tracking per account
+- /report accepts Content-Type: application/msgpack (same fields as the JSON body),
+  /accounts answers in msgpack when the client sends Accept: application/msgpack
 Deploy free on: Render.com or Railway.app
+Run with: gunicorn -k gevent -w 1 server:app   (state is in-process → one worker)
+          python server.py                     (execs the same gunicorn command)
+          DEV_SERVER=1 python server.py        (built-in Flask server, e.g. on Windows
+                                                where gunicorn doesn't run)
 """
 
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from datetime import datetime, timezone
 import os
-import urllib.request
-import urllib.parse
+import sys
+
+# python server.py → exec gunicorn قبل أي side effects (load_state، threads، getMe، atexit)
+if __name__ == "__main__" and not os.environ.get("DEV_SERVER"):
+    # الـ Werkzeug dev server بيخدم request واحد في المرة → ما نستخدموش في production
+    try:
+        import gunicorn.app.wsgiapp  # noqa: F401
+        import gevent                # noqa: F401
+    except ImportError as e:
+        print(f"Cannot start gunicorn + gevent ({e}).\n"
+              "Install them with: pip install gunicorn gevent\n"
+              "On Windows gunicorn is not supported; run with DEV_SERVER=1 instead.")
+        sys.exit(1)
+    _port = int(os.environ.get("PORT", 5000))
+    print(f"MT4 Monitor Server v2.3 running on port {_port} (gunicorn + gevent)")
+    os.execv(sys.executable, [
+        sys.executable, "-m", "gunicorn",
+        "-k", "gevent", "-w", "1",
+        "-b", f"0.0.0.0:{_port}",
+        "--chdir", os.path.dirname(os.path.abspath(__file__)),
+        "server:app",
+    ])
+
+# gevent لازم يعمل patch للـ stdlib قبل ما flask / urllib3 يفتحوا sockets
+if os.environ.get("USE_GEVENT"):
+    from gevent import monkey
+    monkey.patch_all()
+
+from flask import Flask, request
+from dataclasses import dataclass, field, fields
+import gzip
+import heapq
+import hmac
+import atexit
+from bisect import bisect_right
+import itertools
+import queue
+import urllib3
 import threading
 import time
+import orjson
+import msgpack
+import xxhash
 
 app = Flask(__name__)
-CORS(app)
 
-# In-memory store
-accounts = {}
+# ── CORS: headers ثابتة بدل flask-cors ──
+_CORS_HEADERS = (
+    ("Access-Control-Allow-Origin",   "*"),
+    ("Access-Control-Allow-Methods",  "GET, POST, DELETE, OPTIONS"),
+    ("Access-Control-Allow-Headers",  "X-API-Key, Content-Type, If-None-Match"),
+    ("Access-Control-Expose-Headers", "ETag"),
+)
+
+@app.after_request
+def add_cors_headers(resp):
+    for name, value in _CORS_HEADERS:
+        resp.headers[name] = value
+    return resp
+
+@app.route("/<path:_>", methods=["OPTIONS"])
+def cors_preflight(_):
+    return app.response_class(status=204)
+
+def _json(obj, code=200):
+    """JSON response encoded with orjson (replaces flask.jsonify)."""
+    return app.response_class(orjson.dumps(obj), status=code, mimetype="application/json")
+
+# ── UTC timestamp string, re-formatted at most once per second ──
+_ts_cache = [0, ""]
+
+def _now_str():
+    t = int(time.time())
+    c = _ts_cache
+    if c[0] != t:
+        c[1] = time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(t))
+        c[0] = t
+    return c[1]
+
+def _today_str():
+    return _now_str()[:10]
+
+# ─────────────────────────────────────────────
+# IN-MEMORY STORE (sharded)
+# ─────────────────────────────────────────────
+# كل shard عبارة عن dict + lock مستقل، عشان الـ /report والـ background
+# thread ما يتزاحموش على نفس الـ dict
+SHARDS = 16
+
+class ShardedDict:
+    """Dict split into SHARDS independent (dict, lock) pairs keyed by hash(key)."""
+
+    def __init__(self):
+        self._shards = [({}, threading.Lock()) for _ in range(SHARDS)]
+        # عدد المفاتيح بيتحدث بس مع insert/delete، فـ len() ما بيلمسش أي shard
+        self._count      = 0
+        self._count_lock = threading.Lock()
+
+    def _add_count(self, n):
+        with self._count_lock:
+            self._count += n
+
+    def _shard(self, key):
+        return self._shards[hash(key) & (SHARDS - 1)]
+
+    def get(self, key, default=None):
+        d, lk = self._shard(key)
+        with lk:
+            return d.get(key, default)
+
+    def pop(self, key, default=None):
+        d, lk = self._shard(key)
+        with lk:
+            if key not in d:
+                return default
+            value = d.pop(key)
+        self._add_count(-1)
+        return value
+
+    def __setitem__(self, key, value):
+        d, lk = self._shard(key)
+        with lk:
+            is_new = key not in d
+            d[key] = value
+        if is_new:
+            self._add_count(1)
+
+    def __contains__(self, key):
+        d, lk = self._shard(key)
+        with lk:
+            return key in d
+
+    def __len__(self):
+        return self._count
+
+    def items(self):
+        """Snapshot of (key, value) pairs, taking each shard's lock briefly."""
+        out = []
+        for d, lk in self._shards:
+            with lk:
+                out.extend(d.items())
+        return out
+
+    def keys(self):
+        return [k for k, _ in self.items()]
+
+    def values(self):
+        return [v for _, v in self.items()]
+
+accounts = ShardedDict()
+
+# ── Version counter: أي تعديل على accounts بيزود الـ version ──
+# GET /accounts بيرجع نفس الـ bytes المتخزنة طول ما الـ version ما اتغيرش
+_versions = itertools.count(1)
+_version  = 0
+_boot_id  = int(time.time())    # عشان الـ ETag ما يتكررش بعد restart
+_accounts_cache = {}   # mimetype / (mimetype, "gzip") → (version, encoded bytes)
+GZIP_MIN_SIZE   = 1024  # أصغر من كده الـ gzip header بياكل المكسب
+
+def bump_version():
+    global _version
+    _version = next(_versions)
+
+# ── آخر hash لـ body كل account: لو الـ EA بعت نفس الـ report بالظبط نتخطى الـ parse ──
+_body_hash  = {}   # account_id → xxh3 of last stored body
+_hash_owner = {}   # xxh3 → account_id
 
 # ─────────────────────────────────────────────
 # PROFIT TRACKING
 # ─────────────────────────────────────────────
 # daily_snapshots[account_id] = {
 #   "date": "YYYY-MM-DD",          ← اليوم اللي اتاخد فيه الـ snapshot
-#   "start_balance": float,        ← البالانس أول اليوم
+#   "start_balance": int,          ← البالانس أول اليوم (cents)
 # }
 daily_snapshots = {}
 
-# cumulative_profit[account_id] = float   ← الأرباح المتراكمة من أول يوم
+# cumulative_profit[account_id] = int     ← الأرباح المتراكمة من أول يوم (cents)
 cumulative_profit = {}
 
-# previous_balance[account_id] = float    ← آخر بالانس اتسجل (لحساب الأرباح المحققة)
+# previous_balance[account_id] = int      ← آخر بالانس اتسجل (cents، لحساب الأرباح المحققة)
 previous_balance = {}
 
 def update_profit_tracking(account_id, balance):
-    """Track daily and cumulative profit based on balance changes."""
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    """Track daily and cumulative profit based on balance changes (balance in integer cents)."""
+    today = _today_str()
 
     # ── Initialize if first time ──
     if account_id not in daily_snapshots:
@@ -47,7 +209,7 @@ def update_profit_tracking(account_id, balance):
             "date": today,
             "start_balance": balance
         }
-        cumulative_profit[account_id] = 0.0
+        cumulative_profit[account_id] = 0
         previous_balance[account_id] = balance
         return
 
@@ -72,25 +234,155 @@ TELEGRAM_CHAT  = os.environ.get("TELEGRAM_CHAT_ID", "")
 DANGER_ML      = float(os.environ.get("DANGER_ML",  "150"))
 WARN_ML        = float(os.environ.get("WARN_ML",    "250"))
 MIN_BALANCE    = float(os.environ.get("MIN_BALANCE", "5.0"))
+MIN_BALANCE_CENTS = round(MIN_BALANCE * 100)
+STATE_FILE     = os.environ.get("STATE_FILE",        "state.json")
+STALE_AFTER    = float(os.environ.get("STALE_AFTER", "300"))   # 0 = never expire
+PROFIT_RETENTION_DAYS = int(os.environ.get("PROFIT_RETENTION_DAYS", "30"))
+MONITOR_TICK   = 10
 
 # Alert tracker
-alerted = {}
+alerted = ShardedDict()
+
+# ── Margin-level classification ──
+# ml < DANGER_ML → danger، ml < WARN_ML → warn، غير كده → ok
+# (max عشان لو WARN_ML اتظبط أقل من DANGER_ML يفضل الترتيب sorted زي الـ if/elif القديم)
+ML_THRESHOLDS = (DANGER_ML, max(DANGER_ML, WARN_ML))
+ML_STATES     = ("danger", "warn", "ok")
+
+def classify_margin(ml):
+    return ML_STATES[bisect_right(ML_THRESHOLDS, ml)]
+
+# ── بيصحي الـ background thread بدري لما account يحتاج alert جديد ──
+_wake  = threading.Event()
+_dirty = set()   # accounts اللي الـ alert state بتاعها ممكن يكون اتغير
+
+# ─────────────────────────────────────────────
+# EXPIRY: accounts اللي الـ EA بتاعها بطل يبعت
+# ─────────────────────────────────────────────
+# heap فيه entry واحدة لكل account؛ الـ deadline الحقيقي في _expiry،
+# ولما الـ entry تطلع قديمة بنرجعها بالـ deadline الجديد (lazy reschedule)
+_expiry_heap = []
+_expiry      = {}      # account_id → deadline (مش موجود = dropped)
+_in_heap     = set()   # accounts ليها entry حية في الـ heap، حتى لو اتعملها drop
+_expiry_lock = threading.Lock()
+
+def touch_expiry(acc_id):
+    if not STALE_AFTER:
+        return
+    deadline = time.time() + STALE_AFTER
+    with _expiry_lock:
+        # entry قديمة (حتى بعد drop) بتتعاد استخدامها بدل ما نعمل push تاني
+        if acc_id not in _in_heap:
+            heapq.heappush(_expiry_heap, (deadline, acc_id))
+            _in_heap.add(acc_id)
+        _expiry[acc_id] = deadline
+
+def pop_expired(now):
+    """Return the accounts whose deadline has passed; work is proportional to due entries only."""
+    expired = []
+    with _expiry_lock:
+        while _expiry_heap and _expiry_heap[0][0] <= now:
+            _, acc_id = heapq.heappop(_expiry_heap)
+            deadline  = _expiry.get(acc_id)
+            if deadline is None:
+                _in_heap.discard(acc_id)       # dropped already
+                continue
+            if deadline > now:
+                heapq.heappush(_expiry_heap, (deadline, acc_id))
+            else:
+                del _expiry[acc_id]
+                _in_heap.discard(acc_id)
+                expired.append(acc_id)
+    return expired
+
+# ─────────────────────────────────────────────
+# ACCOUNT RECORD
+# ─────────────────────────────────────────────
+# layout ثابت بدل ما نخزن الـ JSON dict زي ما هو → مفيش hash table لكل account
+# الفلوس متخزنة integer cents (مفيش float drift في الـ profit)، وبتتحول لـ USD بس في الـ output
+@dataclass(slots=True)
+class Account:
+    account_id:              str
+    balance_cents:           int   = 0
+    equity_cents:            int   = 0
+    margin_cents:            int   = 0
+    free_margin_cents:       int   = 0
+    floating_cents:          int   = 0
+    margin_level:            float = 0.0
+    broker:                  str   = ""
+    currency:                str   = "USD"
+    currency_display:        str   = "USD"
+    is_cent:                 bool  = False
+    baskets:                 list  = field(default_factory=list)
+    last_update:             str   = ""
+    daily_profit_cents:      int   = 0
+    cumulative_profit_cents: int   = 0
+    day_start_balance_cents: int   = 0
+
+_FIELDS = tuple(f.name for f in fields(Account))
+
+def _account_dict(acc):
+    """Public shape of an account: *_cents fields become their USD value under the plain name."""
+    out = {}
+    for k in _FIELDS:
+        v = getattr(acc, k)
+        if k.endswith("_cents"):
+            out[k[:-6]] = v / 100
+        else:
+            out[k] = v
+    return out
+
+def drop_account(acc_id, keep_profit=False):
+    """Remove an account and the state tracked for it; returns the removed Account or None.
+
+    keep_profit leaves the profit-tracking maps in place so an account that only went quiet
+    resumes its daily/cumulative profit when its EA reports again.
+    """
+    acc = accounts.pop(acc_id, None)
+    alerted.pop(acc_id, None)
+    if not keep_profit:
+        daily_snapshots.pop(acc_id, None)
+        cumulative_profit.pop(acc_id, None)
+        previous_balance.pop(acc_id, None)
+    _hash_owner.pop(_body_hash.pop(acc_id, None), None)
+    with _expiry_lock:
+        _expiry.pop(acc_id, None)
+    return acc
+
+def prune_hidden_profit():
+    """Forget profit history of hidden accounts whose last report is older than PROFIT_RETENTION_DAYS."""
+    # الـ snapshot date = آخر يوم الـ account بعت فيه report
+    cutoff = time.strftime("%Y-%m-%d", time.gmtime(time.time() - PROFIT_RETENTION_DAYS * 86400))
+    gone = [acc_id for acc_id, snap in list(daily_snapshots.items())
+            if snap["date"] < cutoff and acc_id not in accounts]
+    for acc_id in gone:
+        daily_snapshots.pop(acc_id, None)
+        cumulative_profit.pop(acc_id, None)
+        previous_balance.pop(acc_id, None)
+    if gone:
+        print(f"Pruned profit history of {len(gone)} accounts silent for {PROFIT_RETENTION_DAYS}+ days")
+        bump_version()   # عشان الـ persist thread يكتب الـ state من غيرهم
 
 # ─────────────────────────────────────────────
 # CENT ACCOUNT CONVERTER
 # ─────────────────────────────────────────────
 CENT_CURRENCIES = {"USC", "USc", "usc", "cent", "CENT", "ZAc", "GBp"}
+MONEY_FIELDS    = ("balance", "equity", "margin", "free_margin", "floating")
 
 def normalize_account(data):
-    currency = data.get("currency", "USD")
-    if currency in CENT_CURRENCIES:
-        data["is_cent"]     = True
-        data["balance"]     = round(data.get("balance",    0) / 100, 2)
-        data["equity"]      = round(data.get("equity",     0) / 100, 2)
-        data["margin"]      = round(data.get("margin",     0) / 100, 2)
-        data["free_margin"] = round(data.get("free_margin",0) / 100, 2)
-        data["floating"]    = round(data.get("floating",   0) / 100, 2)
-        for b in data.get("baskets", []):
+    # broker/currency قيم مكررة بين accounts كتير → نسخة واحدة من كل string
+    currency         = sys.intern(str(data.get("currency", "USD")))
+    data["currency"] = currency
+    data["broker"]   = sys.intern(str(data.get("broker", "")))
+    is_cent = currency in CENT_CURRENCIES
+    # cent accounts بتبعت بالسنت أصلاً؛ الباقي بالدولار → × 100
+    scale = 1 if is_cent else 100
+    for k in MONEY_FIELDS:
+        data[k + "_cents"] = round(data.get(k, 0) * scale)
+
+    if is_cent:
+        data["is_cent"] = True
+        for b in data.get("baskets") or []:
             b["buy_profit"]  = round(b.get("buy_profit",  0) / 100, 2)
             b["sell_profit"] = round(b.get("sell_profit", 0) / 100, 2)
             b["net_profit"]  = round(b.get("net_profit",  0) / 100, 2)
@@ -103,54 +395,167 @@ def normalize_account(data):
 # ─────────────────────────────────────────────
 # TELEGRAM
 # ─────────────────────────────────────────────
-def send_telegram(message):
-    if not TELEGRAM_TOKEN or not TELEGRAM_CHAT:
-        return
+# الـ alerts بتتحط في queue وworkers منفصلين بيبعتوها، عشان رد Telegram
+# البطيء ما يوقفش الـ background loop
+ALERT_WORKERS      = 2
+ALERT_BATCH_WINDOW = 1.0    # alerts اللي بتيجي في نفس الثانية بتتبعت في رسالة واحدة
+TELEGRAM_MAX_LEN   = 4096
+
+# connection واحد keep-alive لكل worker → الـ TLS handshake بيحصل مرة واحدة بس
+_http = urllib3.PoolManager(
+    num_pools=1,
+    maxsize=ALERT_WORKERS,
+    headers={"Connection": "keep-alive"},
+    # sendMessage مش idempotent: retry بس لو الـ connect فشل أو Telegram رد 5xx،
+    # مش بعد ما الـ body اتبعت (read timeout / connection reset) عشان الـ alert ما يتكررش
+    retries=urllib3.Retry(
+        total=1,
+        connect=1,
+        read=0,
+        other=0,
+        backoff_factor=0.2,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=None,
+    ),
+    timeout=urllib3.Timeout(connect=2, read=5),
+)
+_alert_q = queue.Queue(maxsize=256)
+
+def _do_send(message):
     try:
-        url  = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-        data = urllib.parse.urlencode({
+        url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+        resp = _http.request("POST", url, fields={
             "chat_id":    TELEGRAM_CHAT,
             "text":       message,
             "parse_mode": "HTML"
-        }).encode()
-        urllib.request.urlopen(urllib.request.Request(url, data), timeout=5)
+        }, encode_multipart=False)
+        # urllib3 ما بيرميش exception على 4xx (token / chat id / HTML غلط) زي urlopen
+        if resp.status >= 300:
+            print(f"Telegram error: HTTP {resp.status} {resp.data.decode(errors='replace')}")
     except Exception as e:
         print(f"Telegram error: {e}")
 
+def _warm_telegram():
+    """Open the pooled TLS connection at boot with a getMe call."""
+    try:
+        _http.request("GET", f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getMe")
+    except Exception as e:
+        print(f"Telegram warm-up error: {e}")
+
+def _chunk_messages(messages):
+    """Join alerts with blank lines into as few chunks under TELEGRAM_MAX_LEN as possible."""
+    chunks, cur = [], ""
+    for msg in messages:
+        msg = msg[:TELEGRAM_MAX_LEN]
+        if cur and len(cur) + 2 + len(msg) > TELEGRAM_MAX_LEN:
+            chunks.append(cur)
+            cur = ""
+        cur = f"{cur}\n\n{msg}" if cur else msg
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+def _alert_worker(warm=False):
+    if warm and TELEGRAM_TOKEN:
+        _warm_telegram()
+    running = True
+    while running:
+        message = _alert_q.get()
+        if message is None:
+            break
+
+        # ── Collect whatever else arrives within the batch window ──
+        batch = [message]
+        t_end = time.monotonic() + ALERT_BATCH_WINDOW
+        while True:
+            remaining = t_end - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                message = _alert_q.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if message is None:
+                running = False
+                break
+            batch.append(message)
+
+        for chunk in _chunk_messages(batch):
+            _do_send(chunk)
+
+def send_telegram(message):
+    if not TELEGRAM_TOKEN or not TELEGRAM_CHAT:
+        return
+    try:
+        _alert_q.put_nowait(message)
+    except queue.Full:
+        print("Telegram queue full, dropping alert")
+
+def _stop_alert_workers():
+    # sentinel لكل worker بعد الرسايل اللي في الـ queue → بيخلصوا الباقي ويقفلوا
+    for _ in _alert_threads:
+        try:
+            _alert_q.put(None, timeout=1)
+        except queue.Full:
+            pass
+    for t in _alert_threads:
+        t.join(timeout=5)
+
+_alert_threads = [threading.Thread(target=_alert_worker, args=(i == 0,), daemon=True)
+                  for i in range(ALERT_WORKERS)]
+for t in _alert_threads:
+    t.start()
+atexit.register(_stop_alert_workers)
+
 # ─────────────────────────────────────────────
 # BACKGROUND THREAD: alerts + cleanup
 # ─────────────────────────────────────────────
 def background_tasks():
-    while True:
-        time.sleep(60)
+    # thresholds كـ locals جوه الـ loop (LOAD_FAST بدل LOAD_GLOBAL)
+    thresholds = ML_THRESHOLDS
+    states     = ML_STATES
 
-        for acc_id in list(accounts.keys()):
-            acc = accounts.get(acc_id)
-            if not acc:
-                continue
+    pruned_day = None
 
-            # ── AUTO CLEANUP: zero balance ────────────────
-            balance = acc.get("balance", 0)
-            if balance < MIN_BALANCE:
-                print(f"Auto-removing low balance account: {acc_id} (balance={balance})")
-                accounts.pop(acc_id, None)
-                alerted.pop(acc_id, None)
-                daily_snapshots.pop(acc_id, None)
-                cumulative_profit.pop(acc_id, None)
-                previous_balance.pop(acc_id, None)
+    while True:
+        _wake.wait(timeout=MONITOR_TICK)
+        _wake.clear()
+
+        # ── Once a day: drop profit history of accounts gone for good ──
+        today = _today_str()
+        if today != pruned_day:
+            prune_hidden_profit()
+            pruned_day = today
+
+        # ── AUTO CLEANUP: EA stopped reporting ────────
+        expired = pop_expired(time.time())
+        for acc_id in expired:
+            print(f"Removing stale account: {acc_id} (no report for {STALE_AFTER:.0f}s, profit history kept)")
+            drop_account(acc_id, keep_profit=True)
+        if expired:
+            bump_version()
+
+        # ── MARGIN ALERTS: only accounts flagged by /report ──
+        while _dirty:
+            try:
+                acc_id = _dirty.pop()
+            except KeyError:
+                break
+            acc = accounts.get(acc_id)
+            if acc is None:
                 continue
 
-            # ── MARGIN ALERTS ─────────────────────────────
-            ml     = acc.get("margin_level", 0)
-            bal    = acc.get("balance",  0)
-            eq     = acc.get("equity",   0)
-            broker = acc.get("broker",   "")
-            cur    = acc.get("currency_display", "USD")
+            ml     = acc.margin_level
+            bal    = acc.balance_cents / 100
+            eq     = acc.equity_cents / 100
+            broker = acc.broker
+            cur    = acc.currency_display
 
             if ml <= 0:
                 continue
 
-            if ml < DANGER_ML:
+            state = states[bisect_right(thresholds, ml)]
+            if state == "danger":
                 if alerted.get(acc_id) != "danger":
                     alerted[acc_id] = "danger"
                     send_telegram(
@@ -161,7 +566,7 @@ def background_tasks():
                         f"Equity:  {eq:.2f} {cur}\n"
                         f"⚠️ Take action immediately!"
                     )
-            elif ml < WARN_ML:
+            elif state == "warn":
                 if alerted.get(acc_id) != "warn":
                     alerted[acc_id] = "warn"
                     send_telegram(
@@ -180,48 +585,183 @@ def background_tasks():
                         f"Account is now safe."
                     )
 
+# ─────────────────────────────────────────────
+# PERSISTENCE: snapshot to STATE_FILE (debounced 1s)
+# ─────────────────────────────────────────────
+# الـ state بيتكتب من thread منفصل لما الـ version يتغير، فالـ /report ما بيستناش الـ disk
+STATE_FORMAT = 2   # 2 = money fields as integer cents
+
+def load_state():
+    if not STATE_FILE:
+        return
+    try:
+        with open(STATE_FILE, "rb") as f:
+            state = orjson.loads(f.read())
+    except FileNotFoundError:
+        return
+    except (OSError, orjson.JSONDecodeError) as e:
+        print(f"State load error: {e}")
+        return
+
+    # ── Parse everything first; a malformed file must not stop the server from booting ──
+    try:
+        if state.get("format") != STATE_FORMAT:
+            print(f"Ignoring {STATE_FILE}: unsupported state format")
+            return
+        restored = [Account(**{k: a[k] for k in _FIELDS if k in a})
+                    for a in state.get("accounts", [])]
+        levels    = dict(state.get("alerted", {}))
+        snapshots = dict(state.get("daily_snapshots", {}))
+        cumul     = dict(state.get("cumulative_profit", {}))
+        prev_bal  = dict(state.get("previous_balance", {}))
+        for acc in restored:
+            hash(acc.account_id)           # unhashable id → TypeError هنا مش في نص الـ restore
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        print(f"State load error: malformed {STATE_FILE} ({e!r}), starting empty")
+        return
+
+    for acc in restored:
+        accounts[acc.account_id] = acc
+        touch_expiry(acc.account_id)
+        _dirty.add(acc.account_id)
+    for acc_id, level in levels.items():
+        alerted[acc_id] = level
+    daily_snapshots.update(snapshots)
+    cumulative_profit.update(cumul)
+    previous_balance.update(prev_bal)
+    bump_version()
+    print(f"Restored {len(accounts)} accounts from {STATE_FILE}")
+
+def save_state():
+    buf = orjson.dumps({
+        "format":            STATE_FORMAT,
+        "accounts":          accounts.values(),
+        "alerted":           dict(alerted.items()),
+        "daily_snapshots":   daily_snapshots,
+        "cumulative_profit": cumulative_profit,
+        "previous_balance":  previous_balance,
+    })
+    # tmp + rename → الملف القديم يفضل سليم لو الـ process وقع في نص الكتابة
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(buf)
+    os.replace(tmp, STATE_FILE)
+
+def try_save_state():
+    """save_state() that logs instead of raising; returns True on success."""
+    try:
+        save_state()
+        return True
+    except Exception as e:
+        # أي error (disk، JSONEncodeError، dict اتغير أثناء الـ dumps) يتسجل بس،
+        # عشان الـ persist thread يفضل شغال ويحاول تاني
+        print(f"State save error: {e!r}")
+        return False
+
+def persist_state():
+    saved = _version
+    while True:
+        time.sleep(1)
+        version = _version
+        if version != saved and try_save_state():
+            saved = version
+
+load_state()
 threading.Thread(target=background_tasks, daemon=True).start()
+if STATE_FILE:
+    threading.Thread(target=persist_state, daemon=True).start()
+    atexit.register(try_save_state)
+
+# ─────────────────────────────────────────────
+# AUTH: X-API-Key على كل الـ endpoints ما عدا /health
+# ─────────────────────────────────────────────
+_API_KEY_BYTES = API_KEY.encode()
+
+@app.before_request
+def check_api_key():
+    if request.endpoint == "health" or request.method == "OPTIONS":
+        return None
+    key = request.headers.get("X-API-Key", "").encode()
+    if not hmac.compare_digest(key, _API_KEY_BYTES):
+        return _json({"error": "unauthorized"}, 401)
+    return None
+
 
 # ─────────────────────────────────────────────
 # POST /report
 # ─────────────────────────────────────────────
 @app.route("/report", methods=["POST"])
 def receive_report():
-    key = request.headers.get("X-API-Key", "")
-    if key != API_KEY:
-        return jsonify({"error": "unauthorized"}), 401
-
-    data = request.get_json(silent=True)
-    if not data:
-        return jsonify({"error": "invalid json"}), 400
+    body = request.get_data(cache=False)
+    h    = xxhash.xxh3_64_intdigest(body)
+
+    # ── Same body as the last stored report → just refresh last_update ──
+    # (يوم جديد → المسار الكامل عشان الـ daily profit يتصفر)
+    acc_id = _hash_owner.get(h)
+    if acc_id is not None:
+        acc  = accounts.get(acc_id)
+        snap = daily_snapshots.get(acc_id)
+        if acc is not None and snap is not None and snap["date"] == _today_str():
+            acc.last_update = _now_str()
+            touch_expiry(acc_id)
+            bump_version()
+            return _json({"status": "ok", "account_id": acc_id, "cached": True}, 200)
+
+    is_msgpack = request.mimetype == "application/msgpack"
+    try:
+        if is_msgpack:
+            # bin/ext ما لهمش مقابل في JSON → لو اتخزنوا، /accounts والـ state save يقعوا
+            data = msgpack.unpackb(body, raw=False, max_bin_len=0, max_ext_len=0)
+            orjson.dumps(data)   # empty bin، bytes keys، ... → JSONEncodeError
+        else:
+            data = orjson.loads(body)
+    except (ValueError, TypeError, msgpack.UnpackException):
+        data = None
+    if not data or not isinstance(data, dict):
+        return _json({"error": "invalid msgpack" if is_msgpack else "invalid json"}, 400)
 
     account_id = str(data.get("account_id", "unknown"))
 
-    # ── Skip zero balance accounts ──────────────
-    balance = data.get("balance", 0)
-    if balance < MIN_BALANCE:
-        return jsonify({"status": "skipped", "reason": f"balance {balance} below minimum {MIN_BALANCE}"}), 200
-
-    data["last_update"] = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+    data["last_update"] = _now_str()
     data = normalize_account(data)
 
-    # ── Track profit (use normalized balance for cent accounts) ──
-    update_profit_tracking(account_id, data.get("balance", 0))
+    # ── Skip (and drop) low balance accounts — checked after cent conversion ──
+    balance = data["balance_cents"]
+    if balance < MIN_BALANCE_CENTS:
+        if drop_account(account_id) is not None:
+            print(f"Auto-removing low balance account: {account_id} (balance={balance / 100:.2f})")
+            bump_version()
+        return _json({"status": "skipped", "reason": f"balance {balance / 100:.2f} below minimum {MIN_BALANCE}"}, 200)
+
+    # ── Track profit (normalized cents, so cent and USD accounts match) ──
+    update_profit_tracking(account_id, balance)
 
     # ── Inject profit data into account ──
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     snap  = daily_snapshots.get(account_id, {})
-    start_bal   = snap.get("start_balance", data.get("balance", 0))
-    daily_prof  = data.get("balance", 0) - start_bal
+    start_bal   = snap.get("start_balance", balance)
+    daily_prof  = balance - start_bal
     cumul_prof  = cumulative_profit.get(account_id, 0) + daily_prof
 
-    data["daily_profit"]      = round(daily_prof, 2)
-    data["cumulative_profit"] = round(cumul_prof, 2)
-    data["day_start_balance"] = round(start_bal, 2)
+    data["daily_profit_cents"]      = daily_prof
+    data["cumulative_profit_cents"] = cumul_prof
+    data["day_start_balance_cents"] = start_bal
+    data["account_id"]        = account_id
+
+    accounts[account_id] = Account(**{k: data[k] for k in _FIELDS if k in data})
+    touch_expiry(account_id)
+    bump_version()
 
-    accounts[account_id] = data
+    _hash_owner.pop(_body_hash.get(account_id), None)
+    _body_hash[account_id] = h
+    _hash_owner[h] = account_id
 
-    return jsonify({"status": "ok", "account_id": account_id}), 200
+    # ── Alert state changed → wake the monitor instead of waiting for the next tick ──
+    ml = data.get("margin_level", 0)
+    if ml > 0 and classify_margin(ml) != alerted.get(account_id, "ok"):
+        _dirty.add(account_id)
+        _wake.set()
+
+    return _json({"status": "ok", "account_id": account_id}, 200)
 
 
 # ─────────────────────────────────────────────
@@ -229,14 +769,35 @@ def receive_report():
 # ─────────────────────────────────────────────
 @app.route("/accounts", methods=["GET"])
 def get_accounts():
-    key = request.headers.get("X-API-Key", "")
-    if key != API_KEY:
-        return jsonify({"error": "unauthorized"}), 401
-
-    return jsonify({
-        "count":    len(accounts),
-        "accounts": list(accounts.values())
-    }), 200
+    mimetype = request.accept_mimetypes.best_match(
+        ("application/json", "application/msgpack"), "application/json")
+    version  = _version
+    suffix   = "-msgpack" if mimetype == "application/msgpack" else ""
+    etag     = f'W/"{_boot_id}-{version}{suffix}"'
+    headers  = {"ETag": etag, "Vary": "Accept, Accept-Encoding"}
+    if request.headers.get("If-None-Match") == etag:
+        return app.response_class(status=304, headers=headers)
+
+    cached_version, body = _accounts_cache.get(mimetype, (None, None))
+    if cached_version != version:
+        snapshot = [_account_dict(a) for a in accounts.values()]
+        payload  = {"count": len(snapshot), "accounts": snapshot}
+        if mimetype == "application/msgpack":
+            body = msgpack.packb(payload)
+        else:
+            body = orjson.dumps(payload)
+        _accounts_cache[mimetype] = (version, body)
+
+    # ── gzip: بيتعمل مرة واحدة لكل version، مش مع كل poll ──
+    if len(body) >= GZIP_MIN_SIZE and request.accept_encodings["gzip"]:
+        cached_version, gz = _accounts_cache.get((mimetype, "gzip"), (None, None))
+        if cached_version != version:
+            gz = gzip.compress(body, compresslevel=6)
+            _accounts_cache[(mimetype, "gzip")] = (version, gz)
+        body = gz
+        headers["Content-Encoding"] = "gzip"
+
+    return app.response_class(body, status=200, mimetype=mimetype, headers=headers)
 
 
 # ─────────────────────────────────────────────
@@ -244,18 +805,10 @@ def get_accounts():
 # ─────────────────────────────────────────────
 @app.route("/account/<account_id>", methods=["DELETE"])
 def delete_account(account_id):
-    key = request.headers.get("X-API-Key", "")
-    if key != API_KEY:
-        return jsonify({"error": "unauthorized"}), 401
-
-    if account_id in accounts:
-        accounts.pop(account_id)
-        alerted.pop(account_id, None)
-        daily_snapshots.pop(account_id, None)
-        cumulative_profit.pop(account_id, None)
-        previous_balance.pop(account_id, None)
-        return jsonify({"status": "deleted", "account_id": account_id}), 200
-    return jsonify({"error": "not found"}), 404
+    if drop_account(account_id) is not None:
+        bump_version()
+        return _json({"status": "deleted", "account_id": account_id}, 200)
+    return _json({"error": "not found"}, 404)
 
 
 # ─────────────────────────────────────────────
@@ -263,31 +816,35 @@ def delete_account(account_id):
 # ─────────────────────────────────────────────
 @app.route("/reset-profit", methods=["POST"])
 def reset_profit():
-    key = request.headers.get("X-API-Key", "")
-    if key != API_KEY:
-        return jsonify({"error": "unauthorized"}), 401
-
-    reset_time = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-
-    for acc_id in list(accounts.keys()):
-        bal = accounts[acc_id].get("balance", 0)
+    reset_time = _now_str()
+    today      = _today_str()
+    live       = dict(accounts.items())
+
+    # ── كل الـ accounts اللي ليها profit history، حتى المخفية (stale) ──
+    reset_ids = set(live) | set(daily_snapshots) | set(cumulative_profit) | set(previous_balance)
+    for acc_id in reset_ids:
+        acc = live.get(acc_id)
+        # المخفية: آخر بالانس معروف هو بداية اليوم الجديد
+        bal = acc.balance_cents if acc is not None else previous_balance.get(acc_id, 0)
         daily_snapshots[acc_id] = {
-            "date": datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+            "date": today,
             "start_balance": bal
         }
-        cumulative_profit[acc_id] = 0.0
+        cumulative_profit[acc_id] = 0
         previous_balance[acc_id] = bal
 
         # Update account data immediately
-        accounts[acc_id]["daily_profit"]      = 0.0
-        accounts[acc_id]["cumulative_profit"] = 0.0
-        accounts[acc_id]["day_start_balance"] = bal
+        if acc is not None:
+            acc.daily_profit_cents      = 0
+            acc.cumulative_profit_cents = 0
+            acc.day_start_balance_cents = bal
+    bump_version()
 
-    return jsonify({
+    return _json({
         "status": "reset",
-        "accounts_reset": len(accounts),
+        "accounts_reset": len(reset_ids),
         "reset_time": reset_time
-    }), 200
+    }, 200)
 
 
 # ─────────────────────────────────────────────
@@ -295,15 +852,16 @@ def reset_profit():
 # ─────────────────────────────────────────────
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({
+    return _json({
         "status":   "online",
         "accounts": len(accounts),
         "telegram": "configured" if TELEGRAM_TOKEN else "not set",
-        "time":     datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-    }), 200
+        "time":     _now_str()
+    }, 200)
 
 
 if __name__ == "__main__":
+    # هنا بس مع DEV_SERVER؛ غير كده الـ exec لـ gunicorn حصل فوق
     port = int(os.environ.get("PORT", 5000))
-    print(f"MT4 Monitor Server v2.3 running on port {port}")
+    print(f"MT4 Monitor Server v2.3 (dev server) running on port {port}")
     app.run(host="0.0.0.0", port=port)